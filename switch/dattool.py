@@ -17,13 +17,15 @@ Format:
 """
 from __future__ import annotations
 
+import errno
 import os
 import re
 import struct
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import BinaryIO, List, Tuple
+from typing import BinaryIO, Iterator, List, Set, Tuple
 
 MAGIC_PREFIX = b"PS_FS_V1?"
 HEADER_SIZE = 0x10
@@ -31,6 +33,12 @@ ENTRY_SIZE  = 0x40
 NAME_LEN    = 0x30
 ALIGN       = 0x10  # alignment khi pack (an toàn)
 
+ENTRY_STRUCT = struct.Struct(f"<{NAME_LEN}sQQ")  # name, size, offset
+TABLE_CHUNK  = ENTRY_SIZE * 1024  # số byte bảng đọc mỗi lần khi parse
+COPY_BUFSIZE = 256 * 1024         # buffer copy khi không dùng được sendfile
+IO_BUFSIZE   = 1 << 20            # buffer của file handle (gộp các read/write nhỏ)
+UNPACK_WORKERS = min(32, (os.cpu_count() or 1) * 2)  # thread trích file (I/O-bound)
+
 
 @dataclass
 class Entry:
@@ -40,14 +48,6 @@ class Entry:
     offset: int
 
 
-def u64le(x: int) -> bytes:
-    return struct.pack("<Q", x)
-
-
-def read_u64_le(b: bytes) -> int:
-    return struct.unpack("<Q", b)[0]
-
-
 def parse_archive(fin: BinaryIO) -> Tuple[bytes, List[Entry]]:
     header = fin.read(HEADER_SIZE)
     if len(header) != HEADER_SIZE:
@@ -56,28 +56,28 @@ def parse_archive(fin: BinaryIO) -> Tuple[bytes, List[Entry]]:
         raise ValueError(f"Không đúng PS_FS_V1? .dat. Header={header!r}")
 
     entries: List[Entry] = []
-    idx = 0
     while True:
-        rec = fin.read(ENTRY_SIZE)
-        if len(rec) < ENTRY_SIZE:
-            break
+        # đọc cả khối bảng 1 lần rồi decode hàng loạt bằng iter_unpack
+        buf = fin.read(TABLE_CHUNK)
+        whole = len(buf) - len(buf) % ENTRY_SIZE
+        for name_field, size, offset in ENTRY_STRUCT.iter_unpack(memoryview(buf)[:whole]):
+            name_raw = name_field.split(b"\x00", 1)[0]
+            if len(name_raw) == 0 and size == 0 and offset == 0:
+                return header, entries
 
-        name_raw = rec[:NAME_LEN].split(b"\x00", 1)[0]
-        size = read_u64_le(rec[NAME_LEN:NAME_LEN + 8])
-        offset = read_u64_le(rec[NAME_LEN + 8:NAME_LEN + 16])
+            name = name_raw.decode("utf-8", "replace")
+            entries.append(Entry(len(entries), name, size, offset))
 
-        if len(name_raw) == 0 and size == 0 and offset == 0:
-            break
+        if len(buf) < TABLE_CHUNK:
+            return header, entries
 
-        name = name_raw.decode("utf-8", "replace")
-        entries.append(Entry(idx, name, size, offset))
-        idx += 1
 
-    return header, entries
+_SPLIT_RE = re.compile(r"[\\/]+")
+_BAD_CHARS_TABLE = str.maketrans({c: "_" for c in '<>:"/\\|?*'})
 
 
 def split_rel_path(name: str) -> List[str]:
-    parts = re.split(r"[\\/]+", name.strip())
+    parts = _SPLIT_RE.split(name.strip())
     return [p for p in parts if p]
 
 
@@ -85,7 +85,7 @@ def sanitize_part(part: str) -> str:
     part = part.strip()
     if not part:
         return "_"
-    part = re.sub(r'[<>:"/\\\\|?*]', "_", part)
+    part = part.translate(_BAD_CHARS_TABLE)
     part = part.rstrip(" .")
     return part or "_"
 
@@ -97,52 +97,123 @@ def safe_output_path(base_dir: Path, name: str) -> Path:
     return base_dir.joinpath(*parts)
 
 
-def ensure_unique_path(p: Path) -> Path:
-    if not p.exists():
+def ensure_unique_path(p: Path, emitted: Set[object]) -> Path:
+    # Mở "wb" giữ chỗ luôn (file còn từ lần unpack trước thì bị ghi đè), không stat() trước.
+    # emitted: (st_dev, st_ino) các file đã tạo trong lần này -> FS tự quyết thế nào là trùng
+    # (NTFS/APFS mở a.bin ra chính file A.bin vừa tạo). Trùng file đó hoặc trùng thư mục -> __dupN.
+    def claim(c: Path) -> bool:
+        try:
+            with c.open("wb") as f:
+                st = os.fstat(f.fileno())
+        except OSError:
+            if c.is_dir():
+                return False
+            raise
+        ident = (st.st_dev, st.st_ino) if st.st_ino else c  # FS không có inode -> so theo path
+        if ident in emitted:
+            return False
+        emitted.add(ident)
+        return True
+
+    if claim(p):
         return p
     stem = p.stem
     suffix = p.suffix
     parent = p.parent
     for i in range(1, 10_000):
         cand = parent / f"{stem}__dup{i}{suffix}"
-        if not cand.exists():
+        if claim(cand):
             return cand
     raise RuntimeError(f"Quá nhiều trùng tên: {p}")
 
 
-def copy_range(fin: BinaryIO, offset: int, size: int, fout: BinaryIO, chunk: int = 1024 * 1024) -> None:
-    fin.seek(offset)
+# sendfile: copy trong kernel, không qua user space (chỉ tin cậy cho file thường trên Linux)
+_USE_SENDFILE = hasattr(os, "sendfile") and sys.platform.startswith("linux")
+
+
+def _sendfile_range(fin: BinaryIO, offset: int, size: int, fout: BinaryIO) -> None:
+    fout.flush()  # sendfile ghi thẳng vào fd, bỏ qua buffer của Python
+    in_fd = fin.fileno()
+    out_fd = fout.fileno()
     remaining = size
     while remaining > 0:
-        n = min(chunk, remaining)
-        buf = fin.read(n)
-        if not buf:
+        sent = os.sendfile(out_fd, in_fd, offset, min(remaining, 0x7FFFF000))
+        if sent == 0:
             raise IOError("EOF bất ngờ khi trích.")
-        fout.write(buf)
-        remaining -= len(buf)
+        offset += sent
+        remaining -= sent
+
+
+def _copy_n(fin: BinaryIO, fout: BinaryIO, size: int, chunk: int = COPY_BUFSIZE) -> None:
+    # copy đúng size byte từ vị trí hiện tại của fin, dùng lại 1 buffer (readinto)
+    mv = memoryview(bytearray(min(chunk, size)))
+    remaining = size
+    while remaining > 0:
+        n = fin.readinto(mv[:min(chunk, remaining)])
+        if not n:
+            raise IOError("EOF bất ngờ khi trích.")
+        fout.write(mv[:n])
+        remaining -= n
+
+
+def copy_range(fin: BinaryIO, offset: int, size: int, fout: BinaryIO) -> None:
+    if _USE_SENDFILE:
+        start = fout.tell()
+        try:
+            _sendfile_range(fin, offset, size, fout)
+            return
+        except OSError as e:
+            if e.errno not in (errno.EINVAL, errno.ENOSYS, errno.ENOTSUP):
+                raise
+            # FS không hỗ trợ -> fallback đọc/ghi thường cho lần copy này
+            fout.seek(start)
+
+    fin.seek(offset)
+    _copy_n(fin, fout, size)
+
+
+def _extract_entry(dat_path: Path, e: Entry, out_path: Path) -> None:
+    # mỗi task mở fd riêng -> không tranh nhau seek
+    with dat_path.open("rb") as fin, out_path.open("wb") as fout:
+        if hasattr(os, "posix_fadvise") and e.size:
+            os.posix_fadvise(fin.fileno(), e.offset, e.size, os.POSIX_FADV_SEQUENTIAL)
+        copy_range(fin, e.offset, e.size, fout)
 
 
 def unpack_dat(dat_path: Path) -> Path:
     out_dir = dat_path.with_suffix("")  # thư mục cùng tên (bỏ .dat)
     out_dir.mkdir(parents=True, exist_ok=True)
 
-    with dat_path.open("rb") as fin:
+    with dat_path.open("rb", buffering=IO_BUFSIZE) as fin:
         _, entries = parse_archive(fin)
         fin.seek(0, os.SEEK_END)
         file_size = fin.tell()
 
-        for e in entries:
-            if e.offset + e.size > file_size:
-                print(f"[SKIP] {e.name}: vượt size file dat")
-                continue
-
-            out_path = safe_output_path(out_dir, e.name)
+    # chọn path output tuần tự (để tên __dupN ổn định) và tạo sẵn file rỗng giữ chỗ,
+    # copy thì chạy song song. File đã nằm trên đĩa -> entry sau cần thư mục trùng tên
+    # sẽ bị mkdir báo lỗi như khi trích tuần tự.
+    jobs: List[Tuple[Entry, Path]] = []
+    ensured_dirs: Set[Path] = {out_dir}
+    emitted: Set[object] = set()
+    for e in entries:
+        if e.offset + e.size > file_size:
+            print(f"[SKIP] {e.name}: vượt size file dat")
+            continue
+
+        out_path = safe_output_path(out_dir, e.name)
+        if out_path.parent not in ensured_dirs:
             out_path.parent.mkdir(parents=True, exist_ok=True)
-            out_path = ensure_unique_path(out_path)
-
-            with out_path.open("wb") as fout:
-                copy_range(fin, e.offset, e.size, fout)
-
+            ensured_dirs.add(out_path.parent)
+        out_path = ensure_unique_path(out_path, emitted)
+        jobs.append((e, out_path))
+
+    # submit theo thứ tự offset -> đọc file dat gần như tuần tự, readahead của OS hiệu quả;
+    # in kết quả theo thứ tự entry như khi trích tuần tự
+    with ThreadPoolExecutor(max_workers=UNPACK_WORKERS) as pool:
+        futures = {e.index: pool.submit(_extract_entry, dat_path, e, out_path)
+                   for e, out_path in sorted(jobs, key=lambda j: j[0].offset)}
+        for e, out_path in jobs:
+            futures[e.index].result()
             print(f"[OK] {e.index:03d} {e.name} -> {out_path.relative_to(out_dir)} ({e.size} bytes)")
 
     return out_dir
@@ -152,13 +223,22 @@ def align_up(x: int, a: int) -> int:
     return (x + (a - 1)) & ~(a - 1) if a > 1 else x
 
 
-def collect_files(folder: Path) -> List[Tuple[str, Path]]:
-    items: List[Tuple[str, Path]] = []
-    for p in folder.rglob("*"):
-        if p.is_file():
-            rel = p.relative_to(folder)
-            arc_name = str(rel).replace("\\", "/")  # tên trong dat dùng /
-            items.append((arc_name, p))
+def _scandir_recursive(root: str, prefix: str = "") -> Iterator[Tuple[str, os.DirEntry]]:
+    # DirEntry cache kết quả is_file()/stat() -> tránh stat() lặp lại khi pack
+    with os.scandir(root) as it:
+        for entry in it:
+            if entry.is_symlink():
+                continue
+            rel = prefix + entry.name
+            if entry.is_dir():
+                yield from _scandir_recursive(entry.path, rel + "/")
+            elif entry.is_file():
+                yield rel, entry
+
+
+def collect_files(folder: Path) -> List[Tuple[str, os.DirEntry]]:
+    # tên trong dat dùng /
+    items = list(_scandir_recursive(str(folder)))
     items.sort(key=lambda t: t[0].lower())  # cố định thứ tự
     return items
 
@@ -186,9 +266,9 @@ def pack_folder(folder: Path) -> Path:
     cur = data_offset
 
     table_entries: List[Tuple[bytes, int, int]] = []
-    for arc_name, file_path in files:
+    for arc_name, entry in files:
         name_b = validate_name_bytes(arc_name)
-        size = file_path.stat().st_size
+        size = entry.stat().st_size
         cur = align_up(cur, ALIGN)
         offset = cur
         table_entries.append((name_b, size, offset))
@@ -196,26 +276,18 @@ def pack_folder(folder: Path) -> Path:
 
     header = MAGIC_PREFIX + b"\x00" * (HEADER_SIZE - len(MAGIC_PREFIX))
 
-    with out_dat.open("wb") as fout:
-        fout.write(header)
-
-        for name_b, size, offset in table_entries:
-            rec = bytearray(ENTRY_SIZE)
-            rec[:len(name_b)] = name_b
-            rec[NAME_LEN:NAME_LEN + 8] = u64le(size)
-            rec[NAME_LEN + 8:NAME_LEN + 16] = u64le(offset)
-            fout.write(rec)
+    table = bytearray(table_size)  # entry cuối để nguyên 0 = terminator
+    for i, (name_b, size, offset) in enumerate(table_entries):
+        ENTRY_STRUCT.pack_into(table, i * ENTRY_SIZE, name_b, size, offset)
 
-        fout.write(b"\x00" * ENTRY_SIZE)  # terminator
+    with out_dat.open("wb", buffering=IO_BUFSIZE) as fout:
+        fout.write(header)
+        fout.write(table)
 
-        for (arc_name, file_path), (_, size, offset) in zip(files, table_entries):
+        for (arc_name, entry), (_, size, offset) in zip(files, table_entries):
             fout.seek(offset)
-            with file_path.open("rb") as fin:
-                while True:
-                    buf = fin.read(1024 * 1024)
-                    if not buf:
-                        break
-                    fout.write(buf)
+            with open(entry.path, "rb") as fin:
+                copy_range(fin, 0, size, fout)
             print(f"[OK] pack {arc_name} ({size} bytes) @0x{offset:08X}")
 
     return out_dat
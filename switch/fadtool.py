@@ -24,20 +24,33 @@ Ghi chú:
 
 from __future__ import annotations
 
+import itertools
+import mmap
+import os
 import re
 import struct
 import sys
 import zlib
+from contextlib import contextmanager
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
 
 YKCMP_MAGIC = b"YKCMP_V1"
+YKCMP_HEADER = struct.Struct("<8sIII")  # magic, flags, file_size, decomp_size
+COMPRESS_CHUNK = 1 << 20  # số byte đưa vào compressobj mỗi lần
+IO_BUFSIZE = 1 << 20  # buffer file output (gộp các write nhỏ của compressor)
 
 HEADER_OFFSET = 0x58
 ENTRY_SIZE = 0x20
 ALIGN = 0x10
 
+INNER_ENTRY_STRUCT = struct.Struct("<I4xI20x")  # size @+0x00, offset @+0x08
+ZERO_ENTRY = bytes(ENTRY_SIZE)  # entry kết thúc bảng
+TABLE_PEEK = 0x10000  # số byte giải nén thử để đọc header + bảng khi pack
+
+REPLACEMENT_RX = re.compile(r"^file_(\d+)\.[^.]+$", re.IGNORECASE)
+
 
 @dataclass
 class FadEntry:
@@ -47,30 +60,52 @@ class FadEntry:
     size: int
 
 
+_U32 = struct.Struct("<I")
+
+
 def u32_le(buf: bytes, off: int) -> int:
-    return struct.unpack_from("<I", buf, off)[0]
+    return _U32.unpack_from(buf, off)[0]
 
 
-def pack_u32_le(x: int) -> bytes:
-    return struct.pack("<I", x)
+pack_u32_le = _U32.pack  # (x: int) -> bytes
 
 
 def align_up(x: int, a: int) -> int:
     return (x + (a - 1)) & ~(a - 1) if a > 1 else x
 
 
+@contextmanager
+def map_file(path: Path) -> Iterator[mmap.mmap]:
+    """
+    mmap read-only cả file (không copy vào bytes); kernel tự đọc dần khi scan tuần tự.
+    """
+    with path.open("rb") as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # file rỗng
+            raise ValueError("File quá nhỏ.") from None
+        with mm:
+            if len(mm) < 0x20:  # size đã có sẵn từ mmap, không cần seek/stat thêm
+                raise ValueError("File quá nhỏ.")
+            if hasattr(mm, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            yield mm
+
+
+ZLIB_HEADERS = (b"\x78\x01", b"\x78\x9C", b"\x78\xDA")
+
+
 def find_zlib_offset(data: bytes, start=0x10, end=0x2000) -> Optional[int]:
     end = min(len(data) - 2, end)
-    for i in range(start, end):
-        b0 = data[i]
-        b1 = data[i + 1]
-        if b0 == 0x78 and b1 in (0x01, 0x9C, 0xDA):
-            return i
-    return None
+    # find() chạy trong C (bytes/mmap đều có), lấy vị trí nhỏ nhất trong 3 header
+    hits = [i for i in (data.find(h, start, end + 1) for h in ZLIB_HEADERS) if i >= 0]
+    return min(hits) if hits else None
 
 
-def ykcmp_decompress(fad_bytes: bytes) -> Tuple[int, int, int, bytes]:
+def ykcmp_decompress(fad_bytes, limit: Optional[int] = None) -> Tuple[int, int, int, bytearray]:
     """
+    fad_bytes: bytes hoặc mmap (bất kỳ buffer nào).
+    limit: chỉ giải nén tối đa limit byte đầu (khi header có decomp_size).
     Returns (flags, file_size_hdr, decomp_size_hdr, decompressed_bytes)
     """
     if len(fad_bytes) < 0x20:
@@ -84,20 +119,40 @@ def ykcmp_decompress(fad_bytes: bytes) -> Tuple[int, int, int, bytes]:
 
     def try_decomp_at(off: int) -> Optional[bytes]:
         d = zlib.decompressobj()
-        out = bytearray()
         pos = off
         chunk = 1 << 20
-        while pos < len(fad_bytes):
-            part = fad_bytes[pos:pos + chunk]
-            pos += len(part)
-            out += d.decompress(part)
-            if decomp_size_hdr and len(out) >= decomp_size_hdr:
-                break
-        out += d.flush()
-        if decomp_size_hdr and len(out) < decomp_size_hdr:
+        with memoryview(fad_bytes) as mv:
+            if not decomp_size_hdr:
+                # không biết size -> gom từng phần rồi join 1 lần
+                parts = []
+                while pos < len(mv) and not d.eof:
+                    with mv[pos:pos + chunk] as part:  # view, không copy
+                        pos += len(part)
+                        parts.append(d.decompress(part))
+                parts.append(d.flush())
+                return b"".join(parts)
+
+            # biết size -> cấp phát sẵn, ghi theo con trỏ (không realloc khi +=)
+            # zlib nén tối đa ~1032:1 nên header sai cũng không cấp phát quá lớn
+            size = min(decomp_size_hdr, (len(mv) - off) * 1032)
+            if limit is not None:
+                size = min(size, limit)
+            out = bytearray(size)
+            wpos = 0
+            while pos < len(mv) and wpos < size and not d.eof:
+                with mv[pos:pos + chunk] as part:
+                    pos += len(part)
+                    got = d.decompress(part, size - wpos)
+                    out[wpos:wpos + len(got)] = got
+                    wpos += len(got)
+        if wpos < size:
+            got = d.flush()[:size - wpos]
+            out[wpos:wpos + len(got)] = got
+            wpos += len(got)
+        if wpos < size:
             # vẫn trả, nhưng cảnh báo ngoài
-            return bytes(out)
-        return bytes(out)
+            del out[wpos:]
+        return out
 
     # Default payload offset
     payload_off = 0x14
@@ -121,42 +176,56 @@ def ykcmp_decompress(fad_bytes: bytes) -> Tuple[int, int, int, bytes]:
     return flags, file_size_hdr, decomp_size_hdr, dec
 
 
-def ykcmp_compress(dec_bytes: bytes, flags: int = 7, level: int = 9) -> bytes:
-    zdata = zlib.compress(dec_bytes, level)
-    file_size = 0x14 + len(zdata)  # 20 + compressed size
-    decomp_size = len(dec_bytes)
-
-    out = bytearray()
-    out += YKCMP_MAGIC
-    out += pack_u32_le(flags)
-    out += pack_u32_le(file_size)
-    out += pack_u32_le(decomp_size)
-    out += zdata
-    return bytes(out)
-
-
-def parse_inner_archive(dec: bytes) -> List[FadEntry]:
+def ykcmp_compress(chunks: Iterable[bytes], fout: BinaryIO, flags: int = 7, level: int = 9) -> int:
+    """
+    Nén stream các đoạn dữ liệu (bytes/bytearray/memoryview) thành YKCMP_V1, ghi thẳng vào fout
+    (phải seek được) -> không cần gộp dữ liệu giải nén lẫn dữ liệu nén thành 1 khối trong RAM.
+    Returns file_size (header 0x14 + compressed size).
+    """
+    start = fout.tell()
+    fout.write(bytes(YKCMP_HEADER.size))  # placeholder, patch lại khi biết size
+
+    co = zlib.compressobj(level)
+    zsize = 0
+    decomp_size = 0
+    for chunk in chunks:
+        mv = memoryview(chunk)
+        for pos in range(0, len(mv), COMPRESS_CHUNK):
+            zpart = co.compress(mv[pos:pos + COMPRESS_CHUNK])
+            fout.write(zpart)
+            zsize += len(zpart)
+        decomp_size += len(mv)
+    zpart = co.flush()
+    fout.write(zpart)
+    zsize += len(zpart)
+
+    file_size = YKCMP_HEADER.size + zsize  # 20 + compressed size
+    end = fout.tell()
+    fout.seek(start)
+    fout.write(YKCMP_HEADER.pack(YKCMP_MAGIC, flags, file_size, decomp_size))
+    fout.seek(end)
+    return file_size
+
+
+def parse_inner_archive(dec: bytes, total_size: Optional[int] = None) -> List[FadEntry]:
     """
     Parse file table at HEADER_OFFSET with ENTRY_SIZE.
+    total_size: size thật của dữ liệu giải nén khi dec chỉ là phần đầu.
     Stop when:
       - entry is all zeros
       - size/offset invalid or out-of-range
     """
     entries: List[FadEntry] = []
-    filesize = len(dec)
+    filesize = len(dec) if total_size is None else total_size
 
-    idx = 0
-    while True:
+    count = max(0, (len(dec) - HEADER_OFFSET) // ENTRY_SIZE)
+    table = memoryview(dec)[HEADER_OFFSET:HEADER_OFFSET + count * ENTRY_SIZE]
+    for idx, (size, offset) in enumerate(INNER_ENTRY_STRUCT.iter_unpack(table)):
         pos = HEADER_OFFSET + idx * ENTRY_SIZE
-        if pos + ENTRY_SIZE > filesize:
-            break
-        ent = dec[pos:pos + ENTRY_SIZE]
-        if all(b == 0 for b in ent):
+        ent = table[idx * ENTRY_SIZE:(idx + 1) * ENTRY_SIZE]
+        if ent == ZERO_ENTRY:
             break
 
-        size = int.from_bytes(ent[0x00:0x04], "little")
-        offset = int.from_bytes(ent[0x08:0x0C], "little")
-
         # stop if invalid
         if size <= 0 or offset <= 0:
             break
@@ -164,7 +233,6 @@ def parse_inner_archive(dec: bytes) -> List[FadEntry]:
             break
 
         entries.append(FadEntry(idx, pos, offset, size))
-        idx += 1
 
     if not entries:
         raise ValueError("Không tìm thấy entry nào trong bảng file (check HEADER_OFFSET/ENTRY_SIZE).")
@@ -177,13 +245,14 @@ def guess_digits(n: int) -> int:
 
 
 def unpack_fad(fad_path: Path) -> Path:
-    fad_bytes = fad_path.read_bytes()
-    flags, file_size_hdr, decomp_size_hdr, dec = ykcmp_decompress(fad_bytes)
+    with map_file(fad_path) as mm:
+        flags, file_size_hdr, decomp_size_hdr, dec = ykcmp_decompress(mm)
+        fad_size = len(mm)
 
     # Info
     print(f"[*] Input: {fad_path}")
     print(f"[*] Flags @0x08: {flags}")
-    print(f"[*] Header file_size @0x0C: {file_size_hdr}  (real={len(fad_bytes)})")
+    print(f"[*] Header file_size @0x0C: {file_size_hdr}  (real={fad_size})")
     print(f"[*] Header decomp_size @0x10: {decomp_size_hdr} (real={len(dec)})")
     if decomp_size_hdr and len(dec) != decomp_size_hdr:
         print(f"[WARN] Decompressed size mismatch: hdr={decomp_size_hdr}, real={len(dec)}")
@@ -193,8 +262,9 @@ def unpack_fad(fad_path: Path) -> Path:
     out_dir.mkdir(parents=True, exist_ok=True)
 
     digits = guess_digits(len(entries))
+    dec_view = memoryview(dec)
     for e in entries:
-        chunk = dec[e.offset:e.offset + e.size]
+        chunk = dec_view[e.offset:e.offset + e.size]
         out_name = f"file_{e.index:0{digits}d}.bin"
         out_path = out_dir / out_name
         out_path.write_bytes(chunk)
@@ -209,55 +279,98 @@ def collect_replacements(folder: Path) -> Dict[int, Path]:
     Collect files like file_00.bin, file_01.bin, ... (any extension accepted)
     """
     mp: Dict[int, Path] = {}
-    rx = re.compile(r"^file_(\d+)\.[^.]+$", re.IGNORECASE)
-    for p in folder.iterdir():
-        if not p.is_file():
-            continue
-        m = rx.match(p.name)
-        if not m:
-            continue
-        idx = int(m.group(1))
-        # If duplicated, pick lexicographically smaller (stable)
-        if idx not in mp or p.name < mp[idx].name:
-            mp[idx] = p
+    with os.scandir(folder) as it:
+        for de in it:
+            m = REPLACEMENT_RX.match(de.name)
+            if not m or not de.is_file(follow_symlinks=False):
+                continue
+            idx = int(m.group(1))
+            # If duplicated, pick lexicographically smaller (stable)
+            if idx not in mp or de.name < mp[idx].name:
+                mp[idx] = Path(de.path)
     return mp
 
 
+def _iter_pack_data(layout: List[Tuple[FadEntry, int, int, int]],
+                    rep: Dict[int, Path],
+                    dec0: bytes,
+                    base_data_off: int) -> Iterator[bytes]:
+    """
+    Yield dữ liệu vùng data theo layout (gap + nội dung + padding ALIGN).
+    File thay thế được đọc qua 1 buffer dùng lại -> bộ nhớ O(COMPRESS_CHUNK).
+    """
+    buf = memoryview(bytearray(COMPRESS_CHUNK))
+    dec_view = memoryview(dec0)
+    pos = base_data_off
+    for e, raw_size, new_off, new_size in layout:
+        if new_off > pos:
+            yield bytes(new_off - pos)
+
+        # load new data or fallback old data
+        if e.index in rep:
+            with rep[e.index].open("rb") as fin:
+                remaining = raw_size
+                while remaining > 0:
+                    n = fin.readinto(buf[:min(remaining, len(buf))])
+                    if not n:
+                        raise IOError(f"Đọc thiếu dữ liệu: {rep[e.index]}")
+                    yield buf[:n]
+                    remaining -= n
+        else:
+            yield dec_view[e.offset:e.offset + e.size]
+
+        if new_size > raw_size:
+            yield bytes(new_size - raw_size)
+        pos = new_off + new_size
+
+
 def pack_fad(original_fad: Path, folder: Path) -> Path:
     if not original_fad.exists():
         raise FileNotFoundError(original_fad)
     if not folder.is_dir():
         raise NotADirectoryError(folder)
 
-    fad_bytes = original_fad.read_bytes()
-    flags, _, decomp_size_hdr, dec0 = ykcmp_decompress(fad_bytes)
-    entries = parse_inner_archive(dec0)
-
     rep = collect_replacements(folder)
 
+    with map_file(original_fad) as mm:
+        # Chỉ giải nén header + bảng trước; data gốc chỉ cần khi thiếu file thay thế
+        peek = TABLE_PEEK
+        while True:
+            flags, _, decomp_size_hdr, dec0 = ykcmp_decompress(mm, limit=peek)
+            complete = len(dec0) < peek or len(dec0) >= decomp_size_hdr
+            if complete:
+                break
+            entries = parse_inner_archive(dec0, total_size=decomp_size_hdr)
+            table_end = HEADER_OFFSET + (len(entries) + 1) * ENTRY_SIZE
+            if len(dec0) >= max(table_end, min(e.offset for e in entries)):
+                break
+            peek *= 2
+
+        if not complete and any(e.index not in rep for e in entries):
+            flags, _, decomp_size_hdr, dec0 = ykcmp_decompress(mm)
+            complete = True
+
+    if complete:
+        entries = parse_inner_archive(dec0)
+
     base_data_off = min(e.offset for e in entries)
     # Keep header+table+unknown bytes intact up to the first data offset
     header_block = bytearray(dec0[:base_data_off])
 
+    # Pass 1: tính layout + patch bảng (chỉ cần size, chưa đọc dữ liệu)
+    layout: List[Tuple[FadEntry, int, int, int]] = []  # (entry, raw_size, new_off, new_size)
     cur = base_data_off
-    data_out = bytearray()
-
-    # Build new data in same order
     for e in entries:
-        # load new data or fallback old data
         if e.index in rep:
-            raw = rep[e.index].read_bytes()
+            raw_size = rep[e.index].stat().st_size
         else:
             print(f"[WARN] Thiếu file_{e.index}.xxx trong folder -> giữ dữ liệu gốc.")
-            raw = dec0[e.offset:e.offset + e.size]
+            raw_size = e.size
 
         # pad to ALIGN
-        if len(raw) % ALIGN != 0:
-            raw += b"\x00" * (ALIGN - (len(raw) % ALIGN))
-
         cur = align_up(cur, ALIGN)
         new_off = cur
-        new_size = len(raw)
+        new_size = align_up(raw_size, ALIGN)
 
         # patch table: size @+0x00, offset @+0x08
         table_pos = e.table_pos
@@ -265,31 +378,25 @@ def pack_fad(original_fad: Path, folder: Path) -> Path:
         if table_pos + ENTRY_SIZE > len(header_block):
             raise ValueError("Header block không đủ dài để patch bảng (base_data_off quá nhỏ?).")
 
-        header_block[table_pos + 0x00:table_pos + 0x04] = pack_u32_le(new_size)
-        header_block[table_pos + 0x08:table_pos + 0x0C] = pack_u32_le(new_off)
+        _U32.pack_into(header_block, table_pos + 0x00, new_size)
+        _U32.pack_into(header_block, table_pos + 0x08, new_off)
 
-        # append data with possible gap (shouldn't happen if contiguous)
-        desired_data_pos = new_off - base_data_off
-        if desired_data_pos < 0:
-            raise ValueError("Offset tính ra âm (lỗi).")
-        if desired_data_pos > len(data_out):
-            data_out += b"\x00" * (desired_data_pos - len(data_out))
-
-        data_out += raw
+        layout.append((e, raw_size, new_off, new_size))
         cur = new_off + new_size
 
         print(f"[OK] pack idx={e.index}  off=0x{new_off:X}  size=0x{new_size:X}")
 
-    dec_new = bytes(header_block) + bytes(data_out)
+    dec_new_size = cur
 
-    if decomp_size_hdr and len(dec_new) != decomp_size_hdr:
+    if decomp_size_hdr and dec_new_size != decomp_size_hdr:
         # Nhiều game không cần giữ decomp_size cũ, header YKCMP sẽ ghi size mới.
-        print(f"[INFO] Decompressed size changed: old={decomp_size_hdr}, new={len(dec_new)}")
-
-    fad_new = ykcmp_compress(dec_new, flags=flags, level=9)
+        print(f"[INFO] Decompressed size changed: old={decomp_size_hdr}, new={dec_new_size}")
 
+    # Pass 2: stream header + dữ liệu từng file thẳng vào compressor (không gộp thành 1 khối)
     out_path = original_fad.with_name(original_fad.stem + "_new" + original_fad.suffix)
-    out_path.write_bytes(fad_new)
+    with out_path.open("wb", buffering=IO_BUFSIZE) as fout:
+        chunks = _iter_pack_data(layout, rep, dec0, base_data_off)
+        ykcmp_compress(itertools.chain((header_block,), chunks), fout, flags=flags, level=9)
 
     print(f"\nDONE. Wrote: {out_path}")
     return out_path
@@ -1,8 +1,20 @@
 # tex_tool_2way.py
+import mmap
+import os
 import struct
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 
-from PIL import Image, ImageChops
+import numpy as np
+from PIL import Image
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
 
 # =========================
 # Helpers: swizzle (Vita-like)
@@ -16,58 +28,91 @@ def part1by1_16(n: int) -> int:
     n = (n | (n << 1)) & 0x55555555
     return n
 
+def part1by1_16_vec(n: np.ndarray) -> np.ndarray:
+    # giống part1by1_16 nhưng cho cả mảng một lần
+    n = n.astype(np.uint32) & 0xFFFF
+    n = (n | (n << 8)) & 0x00FF00FF
+    n = (n | (n << 4)) & 0x0F0F0F0F
+    n = (n | (n << 2)) & 0x33333333
+    n = (n | (n << 1)) & 0x55555555
+    return n
+
 def morton2(x: int, y: int) -> int:
     return part1by1_16(x) | (part1by1_16(y) << 1)
 
+@lru_cache(maxsize=32)
+def morton_src_index(w: int, h: int, bw: int = 8, bh: int = 8) -> np.ndarray:
+    """
+    Bảng index (h, w): pixel (x,y) tuyến tính nằm ở pixel thứ mấy trong buffer swizzled
+    (blocks theo Morton order, pixel trong block tuyến tính).
+    Cache theo kích thước (texture cùng size dùng lại bảng) -> trả về mảng read-only.
+    """
+    xs = np.arange(w)
+    ys = np.arange(h)
+    mx = part1by1_16_vec(xs // bw).astype(np.int64)
+    my = part1by1_16_vec(ys // bh).astype(np.int64)
+    bi = mx[None, :] | (my[:, None] << 1)
+    idx = bi * (bw * bh) + (ys % bh)[:, None] * bw + (xs % bw)[None, :]
+    idx.setflags(write=False)
+    return idx
+
+if njit is not None:
+    _part1by1_nb = njit(cache=True)(part1by1_16)
+
+    @njit(parallel=True, cache=True, boundscheck=False)
+    def _unswizzle_blocks_nb(pix, out, w, h, bw, bh):
+        # pix/out: (N, k) - k=1 khi đã view sang uint16/uint32
+        for y in prange(h):
+            iy = y % bh
+            my = _part1by1_nb(y // bh) << 1
+            for x in range(w):
+                src = (_part1by1_nb(x // bw) | my) * (bw * bh) + iy * bw + x % bw
+                out[y * w + x, :] = pix[src, :]
+
+PIXEL_WORDS = {2: np.uint16, 4: np.uint32}
+
+def as_pixel_words(pix: np.ndarray) -> np.ndarray:
+    # (N, bpp) uint8 -> (N, 1) uint16/uint32 khi bpp=2/4: copy nguyên pixel 1 lần thay vì từng byte
+    word = PIXEL_WORDS.get(pix.shape[1])
+    return pix.view(word) if word is not None else pix
+
 def unswizzle_morton_blocks(raw: bytes, w: int, h: int, bpp: int, bw: int = 8, bh: int = 8) -> bytes:
     # blocks in Morton order, pixels inside block are linear
-    block_bytes = bw * bh * bpp
-    out = bytearray(w * h * bpp)
-    mv = memoryview(raw)
-    ov = memoryview(out)
-
-    for y in range(h):
-        by = y // bh
-        iy = y % bh
-        row_off = y * w * bpp
-        for x in range(w):
-            bx = x // bw
-            ix = x % bw
-            bi = morton2(bx, by)
-            src = bi * block_bytes + (iy * bw + ix) * bpp
-            dst = row_off + x * bpp
-            if src + bpp <= len(mv):
-                ov[dst:dst + bpp] = mv[src:src + bpp]
-            else:
-                ov[dst:dst + bpp] = b"\x00" * bpp
-    return bytes(out)
+    if w <= 0 or h <= 0:
+        return b""
+    # số pixel tới hết block Morton cuối cùng; data thiếu -> pad 0 một lần, khỏi check từng pixel
+    need = (morton2((w - 1) // bw, (h - 1) // bh) + 1) * bw * bh
+    pix = np.frombuffer(raw, dtype=np.uint8, count=min(len(raw) // bpp, need) * bpp).reshape(-1, bpp)
+    if len(pix) < need:
+        pix = np.concatenate([pix, np.zeros((need - len(pix), bpp), dtype=np.uint8)])
+
+    pix = as_pixel_words(pix)
+
+    if njit is not None:
+        out = np.empty_like(pix, shape=(w * h, pix.shape[1]))
+        _unswizzle_blocks_nb(pix, out, w, h, bw, bh)
+        return out.tobytes()
+
+    # gather 1 lần
+    return pix[morton_src_index(w, h, bw, bh).ravel()].tobytes()
 
 def swizzle_morton_blocks(linear: bytes, w: int, h: int, bpp: int, bw: int = 8, bh: int = 8) -> bytes:
     # inverse of unswizzle_morton_blocks
-    block_bytes = bw * bh * bpp
-    out = bytearray(w * h * bpp)
-    mv = memoryview(linear)
-    ov = memoryview(out)
-
-    for y in range(h):
-        by = y // bh
-        iy = y % bh
-        row_off = y * w * bpp
-        for x in range(w):
-            bx = x // bw
-            ix = x % bw
-            bi = morton2(bx, by)
-            dst = bi * block_bytes + (iy * bw + ix) * bpp
-            src = row_off + x * bpp
-            if dst + bpp <= len(ov):
-                ov[dst:dst + bpp] = mv[src:src + bpp]
-    return bytes(out)
+    dst = morton_src_index(w, h, bw, bh).ravel()
+    pix = as_pixel_words(np.frombuffer(linear, dtype=np.uint8, count=w * h * bpp).reshape(-1, bpp))
+
+    # scatter 1 lần; pixel rơi ra ngoài buffer w*h thì bỏ
+    out = np.zeros_like(pix)
+    valid = dst < len(out)
+    out[dst[valid]] = pix[valid]
+    return out.tobytes()
 
 # =========================
 # Helpers: format/parse
 # =========================
 
 DATA_OFF = 0x30
+BATCH_WORKERS = os.cpu_count() or 1  # decode+swizzle tốn CPU -> 1 process / core
 
 def u32(buf: bytes, off: int) -> int:
     return struct.unpack_from("<I", buf, off)[0]
@@ -102,10 +147,11 @@ def rgba_to_mask_rgb(img_rgba: Image.Image) -> Image.Image:
     - intensity lấy từ ALPHA
     - RGB = intensity, A=255
     """
-    img = img_rgba.convert("RGBA")
-    a = img.split()[3]                  # L
-    full = Image.new("L", img.size, 255)
-    return Image.merge("RGBA", (a, a, a, full))
+    arr = np.asarray(img_rgba.convert("RGBA"))
+    out = np.empty_like(arr)
+    out[..., :3] = arr[..., 3:4]
+    out[..., 3] = 255
+    return Image.fromarray(out, "RGBA")
 
 def mask_rgb_to_transparent(img_rgba: Image.Image) -> Image.Image:
     """
@@ -113,11 +159,11 @@ def mask_rgb_to_transparent(img_rgba: Image.Image) -> Image.Image:
     - alpha = MAX(R,G,B)
     - RGB = trắng
     """
-    img = img_rgba.convert("RGBA")
-    r, g, b, a = img.split()
-    mx = ImageChops.lighter(ImageChops.lighter(r, g), b)
-    white = Image.new("L", img.size, 255)
-    return Image.merge("RGBA", (white, white, white, mx))
+    arr = np.asarray(img_rgba.convert("RGBA"))
+    out = np.empty_like(arr)
+    out[..., :3] = 255
+    out[..., 3] = arr[..., :3].max(axis=2)
+    return Image.fromarray(out, "RGBA")
 
 def is_mask_texture(info: dict, base_raw_32: bytes) -> bool:
     """
@@ -131,26 +177,23 @@ def is_mask_texture(info: dict, base_raw_32: bytes) -> bool:
     if info["flags"] != 0x304:
         return False
     # check alpha constant 255 (sample nhanh)
-    mv = memoryview(base_raw_32)
     # sample ~4096 pixels
     step = max(4, (len(base_raw_32) // (4096 * 4)) * 4)
-    for i in range(3, len(base_raw_32), step):
-        if mv[i] != 255:
-            return False
-    return True
+    a = np.frombuffer(base_raw_32, dtype=np.uint8)[3::step]
+    return bool((a == 255).all())
 
 # =========================
 # P8 encode/decode (palette RGBA + index)
 # =========================
 
 def decode_p8(pal_rgba: bytes, idx: bytes, w: int, h: int) -> Image.Image:
-    pal = [pal_rgba[i:i+4] for i in range(0, 0x400, 4)]
-    out = bytearray(w * h * 4)
-    ov = memoryview(out)
-    for i, pi in enumerate(idx):
-        j = i * 4
-        ov[j:j+4] = pal[pi]
-    return Image.frombytes("RGBA", (w, h), bytes(out))
+    # giữ nguyên dạng palette (mode P) -> PNG 8-bit, không phải bung ra RGBA; alpha nằm trong tRNS
+    pal = np.frombuffer(pal_rgba, dtype=np.uint8, count=0x400).reshape(256, 4)
+    img = Image.frombytes("P", (w, h), bytes(idx[:w * h]))
+    img.putpalette(pal[:, :3].tobytes())
+    if (pal[:, 3] != 255).any():
+        img.info["transparency"] = pal[:, 3].tobytes()
+    return img
 
 def encode_p8_from_png(img_rgba: Image.Image) -> tuple[bytes, bytes]:
     """
@@ -171,28 +214,18 @@ def encode_p8_from_png(img_rgba: Image.Image) -> tuple[bytes, bytes]:
     w, h = img.size
 
     raw = img.tobytes()
-    mv = memoryview(raw)
+    arr = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 4)
 
     # 1) Try exact palette if <=256 unique RGBA
-    uniq = {}
-    colors = []
-    for i in range(0, len(raw), 4):
-        c = bytes(mv[i:i+4])
-        if c not in uniq:
-            uniq[c] = len(colors)
-            colors.append(c)
-            if len(colors) > 256:
-                break
-
-    if len(colors) <= 256:
-        pal = bytearray(0x400)
-        for i, c in enumerate(colors):
-            pal[i*4:i*4+4] = c
-        idx = bytearray(w * h)
-        for p in range(w * h):
-            c = bytes(mv[p*4:p*4+4])
-            idx[p] = uniq[c]
-        return bytes(pal), bytes(idx)
+    uniq, first, inv = np.unique(arr.view(np.uint32).ravel(), return_index=True, return_inverse=True)
+    if len(uniq) <= 256:
+        # giữ thứ tự palette theo lần xuất hiện đầu tiên (như bản cũ)
+        order = np.argsort(first)
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        pal = np.zeros(256, dtype=np.uint32)
+        pal[:len(uniq)] = uniq[order]
+        return pal.tobytes(), rank[inv.ravel()].astype(np.uint8).tobytes()
 
     # 2) Quantize with alpha-aware tricks
     # pick a marker RGB for fully transparent pixels (alpha==0) that is not used by opaque pixels
@@ -201,88 +234,49 @@ def encode_p8_from_png(img_rgba: Image.Image) -> tuple[bytes, bytes]:
         (0, 255, 0), (255, 0, 0), (0, 0, 255),
         (255, 255, 255), (0, 0, 0),
     ]
-    opaque_rgbs = set()
     step = max(1, (w * h) // 20000)  # sample up to ~20k pixels
-    for p in range(0, w*h, step):
-        a = mv[p*4 + 3]
-        if a:
-            opaque_rgbs.add((mv[p*4 + 0], mv[p*4 + 1], mv[p*4 + 2]))
-            if len(opaque_rgbs) > 50000:
-                break
+    smp = arr[::step]
+    smp = smp[smp[:, 3] != 0].astype(np.uint32)
+    opaque_rgbs = (smp[:, 0] << 16) | (smp[:, 1] << 8) | smp[:, 2]
+    used = np.isin([(r << 16) | (g << 8) | b for r, g, b in candidates], opaque_rgbs)
     marker = (1, 0, 1)
-    for c in candidates:
-        if c not in opaque_rgbs:
+    for c, u in zip(candidates, used):
+        if not u:
             marker = c
             break
 
     # Build RGB image for quantize:
     # - alpha==0 -> marker color
     # - else -> original RGB but put alpha bucket (0..15) into low nibble of B
-    rgb_bytes = bytearray(w * h * 3)
-    ri = 0
-    for p in range(w * h):
-        r = mv[p*4 + 0]
-        g = mv[p*4 + 1]
-        b = mv[p*4 + 2]
-        a = mv[p*4 + 3]
-        if a == 0:
-            rgb_bytes[ri:ri+3] = bytes(marker)
-        else:
-            b_mod = (b & 0xF0) | (a >> 4)
-            rgb_bytes[ri:ri+3] = bytes((r, g, b_mod))
-        ri += 3
+    rgb = arr[:, :3].copy()
+    a = arr[:, 3]
+    rgb[:, 2] = (rgb[:, 2] & 0xF0) | (a >> 4)
+    rgb[a == 0] = marker
 
-    rgb_img = Image.frombytes("RGB", (w, h), bytes(rgb_bytes))
+    rgb_img = Image.frombytes("RGB", (w, h), rgb.tobytes())
     pimg = rgb_img.quantize(colors=256, method=Image.MEDIANCUT)
     idx = pimg.tobytes()  # w*h
 
     # Build palette by averaging ORIGINAL RGBA per index
-    sums_r = [0] * 256
-    sums_g = [0] * 256
-    sums_b = [0] * 256
-    sums_a = [0] * 256
-    cnts   = [0] * 256
-    cnt_a0 = [0] * 256
-
-    for p, pi in enumerate(idx):
-        r = mv[p*4 + 0]
-        g = mv[p*4 + 1]
-        b = mv[p*4 + 2]
-        a = mv[p*4 + 3]
-        sums_r[pi] += r
-        sums_g[pi] += g
-        sums_b[pi] += b
-        sums_a[pi] += a
-        cnts[pi] += 1
-        if a == 0:
-            cnt_a0[pi] += 1
-
-    pal = bytearray(0x400)
-    for i in range(256):
-        if cnts[i] == 0:
-            pal[i*4:i*4+4] = b"\x00\x00\x00\x00"
-            continue
-
-        # If this index is fully transparent -> force alpha 0 and neutral RGB
-        if cnt_a0[i] == cnts[i]:
-            pal[i*4:i*4+4] = b"\x00\x00\x00\x00"
-            continue
-
-        r = sums_r[i] // cnts[i]
-        g = sums_g[i] // cnts[i]
-        b = sums_b[i] // cnts[i]
-        a = sums_a[i] // cnts[i]
-        pal[i*4:i*4+4] = bytes((r, g, b, a))
-
-    return bytes(pal), idx
+    idx_arr = np.frombuffer(idx, dtype=np.uint8)
+    cnts = np.bincount(idx_arr, minlength=256)
+    cnt_a0 = np.bincount(idx_arr[arr[:, 3] == 0], minlength=256)
+    sums = np.stack([np.bincount(idx_arr, weights=arr[:, c], minlength=256) for c in range(4)], axis=1)
+
+    pal = (sums.astype(np.int64) // np.maximum(cnts, 1)[:, None]).astype(np.uint8)
+    # index trống hoặc toàn pixel alpha=0 -> (0,0,0,0)
+    pal[(cnts == 0) | (cnt_a0 == cnts)] = 0
+
+    return pal.tobytes(), idx
 
 # =========================
 # Main operations
 # =========================
 
 def bin_to_png(bin_path: Path):
-    buf = bin_path.read_bytes()
-    info = parse_bin(buf)
+    # mmap: parse_bin chỉ copy vùng data ra, không đọc cả file vào bytes rồi slice thêm lần nữa
+    with open(bin_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        info = parse_bin(mm)
     w, h = info["w"], info["h"]
     data = info["data"]
     data_size = info["data_size"]
@@ -320,6 +314,46 @@ def bin_to_png(bin_path: Path):
 
     raise ValueError("Không nhận dạng được format để export PNG.")
 
+def prefetch_file(path: Path):
+    # báo kernel đọc trước (không chặn) -> đọc đĩa chạy song song với decode của worker
+    if hasattr(os, "posix_fadvise"):
+        with path.open("rb") as f:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+
+def bins_to_png(folder: Path, jobs: int = BATCH_WORKERS):
+    """
+    Bin > PNG cho cả thư mục (*.bin), mỗi file chạy trên 1 process riêng.
+    Chỉ giữ tối đa 2*jobs file đang chờ/đang chạy (đọc trước) tính từ file cũ nhất chưa xong,
+    để không bắt kernel đọc cả thư mục 1 lúc rồi đẩy mất page worker còn cần.
+    File lỗi chỉ báo [FAIL], không dừng cả batch.
+    """
+    files = sorted(folder.glob("*.bin"))
+    if not files:
+        print("[ERR] Thư mục không có file .bin.")
+        return
+
+    window = 2 * max(1, jobs)
+    pending = deque()
+    todo = iter(files)
+    with ProcessPoolExecutor(max_workers=max(1, jobs)) as pool:
+        def submit_next() -> bool:
+            p = next(todo, None)
+            if p is None:
+                return False
+            prefetch_file(p)  # advise đúng lúc file vào cửa sổ
+            pending.append((pool.submit(bin_to_png, p), p))
+            return True
+
+        while len(pending) < window and submit_next():
+            pass
+        while pending:
+            fut, p = pending.popleft()
+            try:
+                fut.result()
+            except Exception as e:
+                print(f"[FAIL] {p.name}: {e}")
+            submit_next()
+
 def png_to_bin(bin_path: Path, png_path: Path):
     buf = bytearray(bin_path.read_bytes())
     info = parse_bin(buf)
@@ -384,6 +418,16 @@ def ask_path(prompt: str) -> Path:
     return Path(s)
 
 def main():
+    # CLI optional:
+    #   imgtool.py bin2png <file.bin|folder> [jobs]
+    if len(sys.argv) >= 3 and sys.argv[1].lower() == "bin2png":
+        target = Path(sys.argv[2].strip('"'))
+        if target.is_dir():
+            bins_to_png(target, int(sys.argv[3]) if len(sys.argv) >= 4 else BATCH_WORKERS)
+        else:
+            bin_to_png(target)
+        return
+
     print("=== TEX TOOL 2 CHIỀU ===")
     print("1) Bin > PNG")
     print("2) PNG > Bin")
@@ -391,11 +435,14 @@ def main():
 
     try:
         if choice == "1":
-            bin_path = ask_path("Nhập đường dẫn file BIN: ")
+            bin_path = ask_path("Nhập đường dẫn file BIN (hoặc thư mục): ")
             if not bin_path.exists():
                 print("[ERR] Không thấy file BIN.")
                 return
-            bin_to_png(bin_path)
+            if bin_path.is_dir():
+                bins_to_png(bin_path)
+            else:
+                bin_to_png(bin_path)
 
         elif choice == "2":
             bin_path = ask_path("Nhập đường dẫn file BIN gốc: ")
@@ -1,7 +1,13 @@
 # -*- coding: utf-8 -*-
+import os
 import struct
+import sys
+import threading
 import zlib
 import math
+import mmap
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
 from pathlib import Path
 
 try:
@@ -9,12 +15,20 @@ try:
 except ImportError:
     Image = None
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
 
 def count_lsb_zeros(value: int) -> int:
-    c = 0
-    while c < 32 and ((value >> c) & 1) == 0:
-        c += 1
-    return c
+    # value & -value giữ lại đúng bit 1 thấp nhất
+    return ((value & -value).bit_length() - 1) if value & 0xFFFFFFFF else 32
 
 
 class Swizzler:
@@ -40,6 +54,153 @@ class Swizzler:
         off += (x & 0x0F)
         return off
 
+    def get_offsets(self, width: int, height: int, x_step: int = 1):
+        # Giống get_offset nhưng cho cả ảnh: mảng (height*(width/x_step),) offset của pixel (x,y), x chạy theo
+        # bước x_step, theo thứ tự tuyến tính.
+        # Bit X và bit Y không chồng nhau -> offset = phần X + phần Y (2 bảng 1 chiều, cộng broadcast)
+        x = np.arange(0, width, x_step, dtype=np.int64) << self.bppShift
+        y = np.arange(height, dtype=np.int64)
+        off_x = (((x >> 6) << self.xShift)
+                 + (((x & 0x3F) >> 5) << 8)
+                 + (((x & 0x1F) >> 4) << 5)
+                 + (x & 0x0F))
+        off_y = ((y >> self.bhShift) * self.gobStride
+                 + (((y & self.bhMask) >> 3) << 9)
+                 + (((y & 0x07) >> 1) << 6)
+                 + ((y & 0x01) << 4))
+        return (off_y[:, None] + off_x[None, :]).ravel()
+
+
+@lru_cache(maxsize=32)
+def swizzle_index(width: int, height: int, bpp: int, block_height: int):
+    # Bảng offset chỉ phụ thuộc hình dạng texture -> dùng chung cho decode/encode và các file cùng size
+    off = Swizzler(width, bpp, block_height).get_offsets(width, height)
+    off.setflags(write=False)
+    return off
+
+
+@lru_cache(maxsize=32)
+def swizzle_run_index(width: int, height: int, bpp: int, block_height: int):
+    # bpp 1/2/4: 4 bit thấp của byte x đi thẳng vào offset (x & 0x0F) -> mỗi đoạn 16 byte của 1 hàng
+    # vẫn liền nhau trong GOB. Trả (chỉ số đoạn 16 byte theo thứ tự tuyến tính, số đoạn tối thiểu của buffer);
+    # chỉ dùng khi width*bpp chia hết cho 16
+    run = Swizzler(width, bpp, block_height).get_offsets(width, height, 16 // bpp) >> 4
+    run.setflags(write=False)
+    return run, int(run.max()) + 1
+
+
+def _as_runs(buf):
+    # Nhìn buffer uint8 thành các đoạn 16 byte (2 x uint64) để gather/scatter cả đoạn 1 lần
+    return buf[:len(buf) // 16 * 16].view(np.uint64).reshape(-1, 2)
+
+
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def _unswizzle_nb(src, out, width, height, pw, wshift, bhMask, bhShift, bppShift, xShift, gobStride):
+        # Tính offset ngay trong vòng lặp (cùng công thức với Swizzler.get_offset) rồi copy luôn,
+        # khỏi dựng bảng offset H*W; mỗi row 1 thread. Pixel nằm ngoài src giữ 0.
+        # src/out là mảng word: pw word / pixel, offset byte >> wshift ra chỉ số word.
+        n = src.shape[0]
+        for y in prange(height):
+            off_y = ((y >> bhShift) * gobStride
+                     + (((y & bhMask) >> 3) << 9)
+                     + (((y & 0x07) >> 1) << 6)
+                     + ((y & 0x01) << 4))
+            dst = y * width * pw
+            for x in range(width):
+                xb = x << bppShift
+                off = (off_y
+                       + ((xb >> 6) << xShift)
+                       + (((xb & 0x3F) >> 5) << 8)
+                       + (((xb & 0x1F) >> 4) << 5)
+                       + (xb & 0x0F)) >> wshift
+                if off + pw <= n:
+                    for k in range(pw):
+                        out[dst + k] = src[off + k]
+                else:
+                    for k in range(pw):
+                        out[dst + k] = 0
+                dst += pw
+
+
+_scratch = threading.local()
+
+
+def _scratch_buffer(name: str, size: int):
+    """
+    Buffer uint8 dùng lại giữa các lần gọi trong cùng 1 thread (batch nhiều texture cùng cỡ
+    khỏi cấp phát + page fault lại mỗi file). Nội dung cũ KHÔNG được xoá; kết quả trả ra từ
+    buffer này chỉ hợp lệ tới lần gọi kế tiếp trong thread đó.
+    """
+    buf = getattr(_scratch, name, None)
+    if buf is None or buf.size != size:
+        buf = np.empty(size, dtype=np.uint8)
+        setattr(_scratch, name, buf)
+    return buf
+
+
+# bpp 1/2/4: mỗi pixel là 1 word (offset luôn chia hết cho bpp vì x << bppShift, phần còn lại là bội của 16)
+# -> gather/scatter nguyên word; bpp 3 thì đi theo từng byte plane
+PIXEL_LANES = {1: np.uint8, 2: np.uint16, 4: np.uint32} if np is not None else {}
+
+
+def unswizzle(swizzled: bytes, width: int, height: int, bpp: int, block_height: int):
+    """
+    Block-linear -> tuyến tính cho cả ảnh (gather 1 lần), trả mảng uint8 (scratch của thread,
+    dùng xong trước lần gọi sau). Pixel nằm ngoài swizzled -> 0.
+    """
+    src = np.frombuffer(swizzled, dtype=np.uint8)
+    linear = _scratch_buffer("linear", width * height * bpp)
+    lane = PIXEL_LANES.get(bpp)
+    if lane is not None and (width * bpp) % 16 == 0:
+        run, need = swizzle_run_index(width, height, bpp, block_height)
+        if need * 16 <= len(src):
+            np.take(_as_runs(src), run, axis=0, out=_as_runs(linear))
+            return linear
+    if njit is not None:
+        sw = Swizzler(width, bpp, block_height)
+        if lane is not None:
+            _unswizzle_nb(src[:len(src) // bpp * bpp].view(lane), linear.view(lane), width, height,
+                          1, sw.bppShift, sw.bhMask, sw.bhShift, sw.bppShift, sw.xShift, sw.gobStride)
+        else:
+            _unswizzle_nb(src, linear, width, height,
+                          bpp, 0, sw.bhMask, sw.bhShift, sw.bppShift, sw.xShift, sw.gobStride)
+        return linear
+    off = swizzle_index(width, height, bpp, block_height)
+    ok = off + bpp <= len(src)
+    if not ok.all():
+        linear.fill(0)
+    if lane is not None:
+        src_w = src[:len(src) // bpp * bpp].view(lane)
+        linear.view(lane)[ok] = src_w[off[ok] // bpp]
+    else:
+        linear.reshape(-1, bpp)[ok] = src[off[ok, None] + np.arange(bpp)]
+    return linear
+
+
+def swizzle(linear: bytes, width: int, height: int, bpp: int, block_height: int, dsize: int):
+    """
+    Tuyến tính -> block-linear (scatter 1 lần), trả mảng uint8 dsize byte (scratch của thread,
+    dùng xong trước lần gọi sau). Pixel rơi ra ngoài thì bỏ.
+    """
+    src = np.frombuffer(linear, dtype=np.uint8)
+    swizzled = _scratch_buffer("swizzled", dsize)
+    swizzled.fill(0)  # vùng padding giữa các GOB phải là 0
+    lane = PIXEL_LANES.get(bpp)
+    if lane is not None and (width * bpp) % 16 == 0:
+        run, need = swizzle_run_index(width, height, bpp, block_height)
+        if need * 16 <= dsize:
+            _as_runs(swizzled)[run] = _as_runs(src)
+            return swizzled
+    off = swizzle_index(width, height, bpp, block_height)
+    ok = off + bpp <= dsize
+    if lane is not None:
+        swizzled[:dsize // bpp * bpp].view(lane)[off[ok] // bpp] = src.view(lane)[ok]
+    else:
+        # bpp=3 có thể chồng lấn: thứ tự ghi giống loop cũ (pixel sau đè pixel trước)
+        swizzled[off[ok, None] + np.arange(bpp)] = src.reshape(-1, bpp)[ok]
+    return swizzled
+
 
 def find_ykcmp_offset(data: bytes) -> int:
     off = data.find(b"YKCMP_V1")
@@ -49,7 +210,7 @@ def find_ykcmp_offset(data: bytes) -> int:
 
 
 def read_nmpltex_header(data: bytes):
-    if not data.startswith(b"NMPLTEX1"):
+    if data[:8] != b"NMPLTEX1":
         raise ValueError("Không phải file NMPLTEX1 (.nltx).")
     # Dạng raw .nltx của Yomawari: width, height ở 0x18/0x1C
     width = struct.unpack_from("<I", data, 0x18)[0]
@@ -66,9 +227,16 @@ def get_block_height(flags: int) -> int:
     return 1 << bh_exp
 
 
-def ykcmp_decompress(data: bytes, yk_off: int):
+def read_ykcmp_header(data: bytes, yk_off: int):
     yk_type, zsize, dsize = struct.unpack_from("<III", data, yk_off + 8)
     comp_start = yk_off + 0x14
+    if comp_start >= len(data):
+        raise ValueError("Không tìm thấy dữ liệu nén YKCMP.")
+    return yk_type, zsize, dsize, comp_start
+
+
+def ykcmp_decompress(data: bytes, yk_off: int):
+    yk_type, zsize, dsize, comp_start = read_ykcmp_header(data, yk_off)
 
     # Cắt theo zsize; nếu header "phóng đại" thì chỉ lấy đến hết file
     comp_end = min(len(data), comp_start + zsize)
@@ -76,24 +244,96 @@ def ykcmp_decompress(data: bytes, yk_off: int):
     if not comp_data:
         raise ValueError("Không tìm thấy dữ liệu nén YKCMP.")
 
-    raw = zlib.decompress(comp_data)
+    # max_length = dsize: zlib cấp sẵn buffer đúng cỡ và dừng ở dsize,
+    # phần thừa phía sau (nếu có) không cần giải nén rồi cắt bỏ
+    raw = zlib.decompressobj().decompress(comp_data, dsize)
     if len(raw) < dsize:
         raise ValueError("Dữ liệu sau zlib ngắn hơn dsize trong header.")
-    if len(raw) > dsize:
-        raw = raw[:dsize]
     return yk_type, zsize, dsize, comp_start, raw
 
 
 # ========== NLTX -> PNG ==========
 
+PNG_ZLIB_LEVEL = 6  # giống mặc định compress_level của PIL
+# PIL nén IDAT với Z_FILTERED + memLevel 9: dữ liệu đã qua filter PNG nén tốt hơn hẳn default
+PNG_ZLIB_STRATEGY = zlib.Z_FILTERED
+PNG_ZLIB_MEMLEVEL = 9
+PNG_COLOR_TYPES = {"L": 0, "RGB": 2, "RGBA": 6}
+PNG_BLOCK_BYTES = 1 << 16  # filter + nén theo khối hàng ~64 KiB -> RAM không tăng theo cỡ ảnh
+
+
+def _png_chunk(tag: bytes, payload) -> list:
+    return [struct.pack(">I", len(payload)), tag, payload,
+            struct.pack(">I", zlib.crc32(payload, zlib.crc32(tag)))]
+
+
+def _png_filter_rows(cur, prev, bpp: int, out):
+    """
+    Filter 1 khối scanline vào out (n, row_bytes + 1); prev = hàng ngay trên khối (hàng 0 thì toàn 0).
+    Mỗi hàng chọn 1 trong 5 filter PNG theo tổng |byte có dấu| nhỏ nhất (heuristic của libpng/PIL).
+    """
+    b = np.empty_like(cur)  # byte hàng trên
+    b[0] = prev
+    b[1:] = cur[:-1]
+    a = np.zeros_like(cur)  # byte bên trái
+    a[:, bpp:] = cur[:, :-bpp]
+    c = np.zeros_like(cur)  # byte trên-trái
+    c[:, bpp:] = b[:, :-bpp]
+
+    a16, b16, c16 = a.astype(np.int16), b.astype(np.int16), c.astype(np.int16)
+    p = a16 + b16 - c16
+    pa, pb, pc = np.abs(p - a16), np.abs(p - b16), np.abs(p - c16)
+    paeth = np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+    avg = ((a16 + b16) >> 1).astype(np.uint8)
+
+    # uint8 tự wrap mod 256 đúng như PNG
+    filtered = [cur, cur - a, cur - b, cur - avg, cur - paeth]
+    cost = np.stack([np.abs(f.view(np.int8), dtype=np.int16).sum(axis=1, dtype=np.int64)
+                     for f in filtered])
+    choice = cost.argmin(axis=0).astype(np.uint8)
+    out[:, 0] = choice  # 0 None, 1 Sub, 2 Up, 3 Average, 4 Paeth
+    out[:, 1:] = np.choose(choice[:, None], filtered)
+
+
+def write_png_fast(out_path: Path, linear, width: int, height: int, mode: str):
+    """
+    Ghi PNG 8-bit trực tiếp từ buffer pixel tuyến tính (không qua encoder của PIL).
+    Filter + nén từng khối hàng nhỏ qua 1 zlib.compressobj, phần nén ra ghi thẳng thành IDAT:
+    chỉ giữ khối hiện tại + hàng trên nó, RAM không tăng theo cỡ ảnh.
+    """
+    row_bytes = len(linear) // height
+    bpp = row_bytes // width
+    src = np.frombuffer(linear, dtype=np.uint8).reshape(height, row_bytes)
+    block = max(1, PNG_BLOCK_BYTES // row_bytes)
+    rows = _scratch_buffer("png_rows", block * (row_bytes + 1)).reshape(block, row_bytes + 1)
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, PNG_COLOR_TYPES[mode], 0, 0, 0)
+
+    z = zlib.compressobj(PNG_ZLIB_LEVEL, zlib.DEFLATED, 15, PNG_ZLIB_MEMLEVEL, PNG_ZLIB_STRATEGY)
+    prev = np.zeros(row_bytes, dtype=np.uint8)
+    with open(out_path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.writelines(_png_chunk(b"IHDR", ihdr))
+        for y in range(0, height, block):
+            cur = src[y:y + block]
+            out = rows[:len(cur)]
+            _png_filter_rows(cur, prev, bpp, out)
+            prev = cur[-1]
+            data = z.compress(out)
+            if data:
+                f.writelines(_png_chunk(b"IDAT", data))
+        f.writelines(_png_chunk(b"IDAT", z.flush()))
+        f.writelines(_png_chunk(b"IEND", b""))
+
+
 def nltx_to_png(nltx_path: Path):
-    if Image is None:
-        raise RuntimeError("Thiếu thư viện Pillow. Cài bằng: pip install pillow")
+    if np is None:
+        raise RuntimeError("Thiếu thư viện NumPy. Cài bằng: pip install numpy")
 
-    data = nltx_path.read_bytes()
-    width, height, flags = read_nmpltex_header(data)
-    yk_off = find_ykcmp_offset(data)
-    yk_type, zsize, dsize, comp_start, swizzled = ykcmp_decompress(data, yk_off)
+    # mmap: chỉ header + khối nén được đọc thật, không nạp cả file vào bytes
+    with open(nltx_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        width, height, flags = read_nmpltex_header(data)
+        yk_off = find_ykcmp_offset(data)
+        yk_type, zsize, dsize, comp_start, swizzled = ykcmp_decompress(data, yk_off)
 
     pixels = width * height
     if dsize % pixels != 0:
@@ -101,15 +341,7 @@ def nltx_to_png(nltx_path: Path):
     bpp = dsize // pixels
 
     block_height = get_block_height(flags)
-    sw = Swizzler(width, bpp, block_height)
-
-    linear = bytearray(pixels * bpp)
-    for y in range(height):
-        for x in range(width):
-            dst_off = (y * width + x) * bpp
-            src_off = sw.get_offset(x, y)
-            if src_off + bpp <= len(swizzled):
-                linear[dst_off:dst_off + bpp] = swizzled[src_off:src_off + bpp]
+    linear = unswizzle(swizzled, width, height, bpp, block_height)
 
     if bpp == 1:
         mode = "L"       # grayscale
@@ -120,17 +352,39 @@ def nltx_to_png(nltx_path: Path):
     else:
         raise ValueError(f"bpp = {bpp} không được hỗ trợ (chỉ hỗ trợ 1,3,4).")
 
-    img = Image.frombytes(mode, (width, height), bytes(linear))
     out_path = nltx_path.with_suffix(".png")
-    img.save(out_path)
+    write_png_fast(out_path, linear, width, height, mode)
     return out_path
 
 
+# Dùng process chứ không dùng thread: kernel parallel của numba (TBB) mà lần đầu được gọi từ
+# thread phụ thì treo lúc thoát chương trình; mỗi process gọi từ main thread của nó thì không sao
+BATCH_WORKERS = os.cpu_count() or 1
+
+
+def nltxs_to_png(folder: Path, jobs: int = BATCH_WORKERS):
+    """NLTX -> PNG cho cả thư mục (*.nltx), mỗi file chạy trên 1 process. File lỗi chỉ báo, không dừng cả batch."""
+    files = sorted(folder.glob("*.nltx"))
+    if not files:
+        print("Thư mục không có file .nltx:", folder)
+        return
+
+    with ProcessPoolExecutor(max_workers=max(1, jobs)) as pool:
+        futures = {pool.submit(nltx_to_png, p): p for p in files}
+        for fut in as_completed(futures):
+            try:
+                print("Đã xuất PNG:", fut.result())
+            except Exception as e:
+                print(f"Lỗi {futures[fut].name}:", e)
+
+
 # ========== PNG -> NLTX ==========
 
 def png_to_nltx(png_path: Path):
     if Image is None:
         raise RuntimeError("Thiếu thư viện Pillow. Cài bằng: pip install pillow")
+    if np is None:
+        raise RuntimeError("Thiếu thư viện NumPy. Cài bằng: pip install numpy")
 
     # Template .nltx cùng tên, cùng thư mục
     nltx_path = png_path.with_suffix(".nltx")
@@ -139,10 +393,17 @@ def png_to_nltx(png_path: Path):
             f"Không tìm thấy file template .nltx cùng tên: {nltx_path}"
         )
 
-    data = nltx_path.read_bytes()
-    width, height, flags = read_nmpltex_header(data)
-    yk_off = find_ykcmp_offset(data)
-    yk_type, zsize_old, dsize_old, comp_start, _ = ykcmp_decompress(data, yk_off)
+    # Payload cũ sẽ bị thay nên chỉ cần header + phần đuôi của template; lấy ra rồi đóng mmap
+    # ngay (file output trùng tên template, không được ghi đè lúc còn map)
+    with open(nltx_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        width, height, flags = read_nmpltex_header(data)
+        yk_off = find_ykcmp_offset(data)
+        yk_type, zsize_old, dsize_old, comp_start = read_ykcmp_header(data, yk_off)
+        head_len = yk_off + 8
+        _, _, dsize_template = struct.unpack_from("<III", data, head_len)
+        head = data[:head_len]
+        old_comp_end = min(len(data), comp_start + zsize_old)
+        trailing = data[old_comp_end:]
 
     pixels = width * height
     if dsize_old % pixels != 0:
@@ -175,31 +436,20 @@ def png_to_nltx(png_path: Path):
         )
 
     block_height = get_block_height(flags)
-    sw = Swizzler(width, bpp, block_height)
-    swizzled = bytearray(dsize_old)
-    for y in range(height):
-        for x in range(width):
-            src_off = (y * width + x) * bpp
-            dst_off = sw.get_offset(x, y)
-            if dst_off + bpp <= len(swizzled):
-                swizzled[dst_off:dst_off + bpp] = linear[src_off:src_off + bpp]
-
-    # Nén lại bằng zlib, type 7 giữ nguyên
-    zdata = zlib.compress(bytes(swizzled))
-
-    # Dựng lại file NLTX mới: giữ nguyên mọi thứ trừ 3 field type/zsize/dsize + payload
-    header_until_type = data[:yk_off + 8]
-    _, _, dsize_template = struct.unpack_from("<III", data, yk_off + 8)
-    yk_header = struct.pack("<III", yk_type, len(zdata), dsize_template)
+    swizzled = swizzle(linear, width, height, bpp, block_height, dsize_old)
 
-    old_comp_end = min(len(data), comp_start + zsize_old)
-    trailing = data[old_comp_end:]
+    # Nén lại bằng zlib (nhận thẳng buffer của mảng), type 7 giữ nguyên
+    zdata = zlib.compress(swizzled)
 
-    new_data = bytearray()
-    new_data += header_until_type
-    new_data += yk_header
-    new_data += zdata
-    new_data += trailing
+    # Dựng lại file NLTX mới: giữ nguyên mọi thứ trừ 3 field type/zsize/dsize + payload
+    # (cấp buffer đúng cỡ 1 lần rồi ghi từng đoạn vào chỗ)
+    comp_off = head_len + 12
+    new_data = bytearray(comp_off + len(zdata) + len(trailing))
+    mv = memoryview(new_data)
+    mv[:head_len] = head
+    struct.pack_into("<III", new_data, head_len, yk_type, len(zdata), dsize_template)
+    mv[comp_off:comp_off + len(zdata)] = zdata
+    mv[comp_off + len(zdata):] = trailing
 
     out_path = png_path.with_suffix(".nltx")
     out_path.write_bytes(new_data)
@@ -209,6 +459,16 @@ def png_to_nltx(png_path: Path):
 # ========== CLI ==========
 
 def main():
+    # CLI tuỳ chọn:
+    #   nltx.py nltx2png <file.nltx|thư mục> [jobs]
+    if len(sys.argv) >= 3 and sys.argv[1].lower() == "nltx2png":
+        target = Path(sys.argv[2].strip('"'))
+        if target.is_dir():
+            nltxs_to_png(target, int(sys.argv[3]) if len(sys.argv) >= 4 else BATCH_WORKERS)
+        else:
+            print("Đã xuất PNG:", nltx_to_png(target))
+        return
+
     print("=== NLTX <-> PNG tool (YKCMP_V1 / NMPLTEX1) ===")
     print("1) NLTX -> PNG")
     print("2) PNG  -> NLTX (dùng template .nltx cùng tên)")
@@ -216,11 +476,14 @@ def main():
 
     try:
         if choice == "1":
-            path_str = input("Đường dẫn file .nltx: ").strip().strip('\"')
+            path_str = input("Đường dẫn file .nltx (hoặc thư mục): ").strip().strip('\"')
             nltx_path = Path(path_str)
             if not nltx_path.exists():
                 print("Không tìm thấy file:", nltx_path)
                 return
+            if nltx_path.is_dir():
+                nltxs_to_png(nltx_path)
+                return
             out = nltx_to_png(nltx_path)
             print("Đã xuất PNG:", out)
         elif choice == "2":
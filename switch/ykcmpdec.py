@@ -2,6 +2,12 @@
 import os
 import sys
 
+try:
+    import numpy as np
+    from numba import njit
+except ImportError:
+    njit = None
+
 MAGIC = b"YKCMP_V1"
 
 
@@ -18,46 +24,9 @@ def parse_offset(s: str) -> int:
     return int(s, 0)
 
 
-def ykcmp_decompress_from(data: bytes, offset: int) -> bytes:
-    """
-    Giải nén 1 block YKCMP_V1 nằm trong 'data' tại vị trí 'offset' (bắt đầu bằng chữ Y của YKCMP_V1).
-    Trả về: bytes giải nén (không kèm header YKCMP).
-    """
-
-    if offset < 0 or offset + 20 > len(data):
-        raise ValueError("Offset YKCMP nằm ngoài file hoặc header không đủ 20 byte")
-
-    if data[offset:offset + 8] != MAGIC:
-        raise ValueError("Không thấy magic 'YKCMP_V1' tại offset đã cho")
-
-    # Header:
-    # +0x00: "YKCMP_V1" (8)
-    # +0x08: version (4) - thường là 4
-    # +0x0C: zsize = kích thước toàn bộ archive (header + compressed)
-    # +0x10: dsize = kích thước sau giải nén
-    version = int.from_bytes(data[offset + 8:offset + 12], "little")
-    zsize = int.from_bytes(data[offset + 12:offset + 16], "little")
-    dsize = int.from_bytes(data[offset + 16:offset + 20], "little")
-
-    if version != 4:
-        # Với Yomawari / NIS gần như luôn = 4; báo cho dễ debug
-        print(f"[!] Cảnh báo: ARCHIVE_VERSION = {version}, không phải 4 (vẫn thử giải nén).")
-
-    if zsize <= 0:
-        raise ValueError(f"zsize không hợp lệ: {zsize}")
-
-    # archive nằm từ offset .. offset+zsize
-    end_archive = offset + zsize
-    if end_archive > len(data):
-        raise ValueError("zsize vượt quá kích thước file")
-
-    # Compressed data bắt đầu sau header 0x14
-    comp_start = offset + 0x14
-    comp_end = end_archive
-    comp = data[comp_start:comp_end]
+def _ykcmp_core_py(comp: bytes, dsize: int):
+    """Vòng giải nén YKCMP (Python thuần). Trả về (out, dp)."""
     comp_len = len(comp)
-
-    # Buffer output
     out = bytearray(dsize)
 
     cp = 0  # pointer trong dữ liệu nén (comp)
@@ -73,15 +42,12 @@ def ykcmp_decompress_from(data: bytes, offset: int) -> bytes:
 
         # < 0x80: literal copy
         if a < 0x80:
-            num = a
             cp += 1
-            # copy trực tiếp num byte tiếp theo
-            for _ in range(num):
-                if cp >= comp_len or dp >= dsize:
-                    break
-                out[dp] = comp[cp]
-                dp += 1
-                cp += 1
+            # copy trực tiếp num byte tiếp theo (cắt theo phần còn lại của comp/out)
+            num = min(a, comp_len - cp, dsize - dp)
+            out[dp:dp + num] = comp[cp:cp + num]
+            dp += num
+            cp += num
             continue
 
         # >= 0x80: copy lookback
@@ -132,6 +98,17 @@ def ykcmp_decompress_from(data: bytes, offset: int) -> bytes:
             cp += 1
 
         # Thực hiện copy từ out[dp - seekback] length lần
+        src_pos = dp - seekback
+        if src_pos >= 0:
+            # copy theo lát: lát đầu dài seekback, mỗi lát sau gấp đôi (vùng đã chép lặp lại đúng chu kỳ
+            # seekback nên chép tiếp từ src_pos vẫn đúng) -> không chồng lấn chỉ 1 lát, RLE chỉ log(readlen) lát
+            end = dp + min(readlen, dsize - dp)
+            while dp < end:
+                num = min(dp - src_pos, end - dp)
+                out[dp:dp + num] = out[src_pos:src_pos + num]
+                dp += num
+            continue
+
         for _ in range(readlen):
             if dp >= dsize:
                 break
@@ -144,6 +121,104 @@ def ykcmp_decompress_from(data: bytes, offset: int) -> bytes:
             out[dp] = val
             dp += 1
 
+    return out, dp
+
+
+if njit is not None:
+    @njit(cache=True)
+    def _ykcmp_core_nb(comp, out):
+        # giống hệt _ykcmp_core_py, out: np.zeros(dsize) -> trả về dp
+        comp_len = comp.shape[0]
+        dsize = out.shape[0]
+        cp = 0
+        dp = 0
+        while cp < comp_len and dp < dsize:
+            a = np.int64(comp[cp])
+
+            if a == 0:
+                cp += 1
+                continue
+
+            if a < 0x80:
+                cp += 1
+                num = min(a, comp_len - cp, dsize - dp)
+                out[dp:dp + num] = comp[cp:cp + num]
+                dp += num
+                cp += num
+                continue
+
+            if a >= 0xE0:
+                if cp + 2 >= comp_len:
+                    break
+                b = np.int64(comp[cp + 1])
+                c = np.int64(comp[cp + 2])
+                readlen = ((a & 0x1F) << 4) + (b >> 4) + 3
+                seekback = ((b & 0x0F) << 8) + c + 1
+                cp += 3
+            elif a >= 0xC0:
+                if cp + 1 >= comp_len:
+                    break
+                readlen = (a & 0x3F) + 2
+                seekback = np.int64(comp[cp + 1]) + 1
+                cp += 2
+            else:
+                readlen = ((a >> 4) & 0x03) + 1
+                seekback = (a & 0x0F) + 1
+                cp += 1
+
+            for _ in range(readlen):
+                if dp >= dsize:
+                    break
+                src_pos = dp - seekback
+                out[dp] = out[src_pos] if src_pos >= 0 else 0
+                dp += 1
+        return dp
+
+
+def ykcmp_decompress_from(data: bytes, offset: int) -> bytes:
+    """
+    Giải nén 1 block YKCMP_V1 nằm trong 'data' tại vị trí 'offset' (bắt đầu bằng chữ Y của YKCMP_V1).
+    Trả về: bytes giải nén (không kèm header YKCMP).
+    """
+
+    if offset < 0 or offset + 20 > len(data):
+        raise ValueError("Offset YKCMP nằm ngoài file hoặc header không đủ 20 byte")
+
+    if data[offset:offset + 8] != MAGIC:
+        raise ValueError("Không thấy magic 'YKCMP_V1' tại offset đã cho")
+
+    # Header:
+    # +0x00: "YKCMP_V1" (8)
+    # +0x08: version (4) - thường là 4
+    # +0x0C: zsize = kích thước toàn bộ archive (header + compressed)
+    # +0x10: dsize = kích thước sau giải nén
+    version = int.from_bytes(data[offset + 8:offset + 12], "little")
+    zsize = int.from_bytes(data[offset + 12:offset + 16], "little")
+    dsize = int.from_bytes(data[offset + 16:offset + 20], "little")
+
+    if version != 4:
+        # Với Yomawari / NIS gần như luôn = 4; báo cho dễ debug
+        print(f"[!] Cảnh báo: ARCHIVE_VERSION = {version}, không phải 4 (vẫn thử giải nén).")
+
+    if zsize <= 0:
+        raise ValueError(f"zsize không hợp lệ: {zsize}")
+
+    # archive nằm từ offset .. offset+zsize
+    end_archive = offset + zsize
+    if end_archive > len(data):
+        raise ValueError("zsize vượt quá kích thước file")
+
+    # Compressed data bắt đầu sau header 0x14
+    comp_start = offset + 0x14
+    comp_end = end_archive
+    comp = data[comp_start:comp_end]
+
+    if njit is not None:
+        out = np.zeros(dsize, dtype=np.uint8)
+        dp = _ykcmp_core_nb(np.frombuffer(comp, dtype=np.uint8), out)
+    else:
+        out, dp = _ykcmp_core_py(comp, dsize)
+
     if dp != dsize:
         print(f"[!] Cảnh báo: giải nén được {dp} / {dsize} byte (không đủ).")
 
@@ -1,29 +1,26 @@
+import struct
 import sys
+from itertools import accumulate
 from pathlib import Path
 
 def export(dat_path):
     dat = Path(dat_path)
-    with open(dat, 'rb') as f:
-        files_count = int.from_bytes(f.read(4), 'little')
-        f.seek(0x0C)
-        texts = []
-        for _ in range(files_count):
-            pos = f.tell()
-            offset = int.from_bytes(f.read(4), 'little') + 4
-            f.seek(offset)
-            str_bytes = b''
-            while True:
-                b = f.read(1)
-                if not b or b == b'\x00':
-                    break
-                str_bytes += b
-            text = str_bytes.decode('utf-8', errors='replace')
-            text = text.replace('\r\n', '<cf>').replace('\n', '<lf>').replace('\r', '<cr>')
-            texts.append(text)
-            f.seek(pos + 0x0C)
+    data = dat.read_bytes()
+    files_count = int.from_bytes(data[0:4], 'little')
+    # bảng entry 0x0C byte/entry, lấy cả bảng 1 lần (thiếu byte cuối file thì coi như 0)
+    table = data[0x0C:0x0C + files_count * 0x0C].ljust(files_count * 0x0C, b'\x00')
+    parts = []
+    for (offset,) in struct.iter_unpack('<I8x', table):
+        offset += 4
+        # cắt tới byte \x00 (hết file mà không có \x00 thì lấy tới cuối)
+        end = data.find(b'\x00', offset)
+        parts.append(data[offset:end] if end >= 0 else data[offset:])
+    # nối mọi chuỗi bằng \x00 (không thể có trong chuỗi) -> decode + thay xuống dòng 1 lượt cho cả file
+    text = b'\x00'.join(parts).decode('utf-8', errors='replace')
+    text = text.replace('\r\n', '<cf>').replace('\n', '<lf>').replace('\r', '<cr>')
     txt_out = dat.with_suffix('.txt')
     with open(txt_out, 'w', encoding='utf-8') as out:
-        out.write('\n'.join(texts))
+        out.write(text.replace('\x00', '\n'))
     print(f"Xuất xong: {txt_out}")
 
 def import_text(dat_path, txt_path):
@@ -34,6 +31,14 @@ def import_text(dat_path, txt_path):
     if len(lines) == 0:
         print("File TXT rỗng")
         return
+    # đổi tag xuống dòng 1 lượt cho cả file: nối dòng bằng \x00 (ký tự kết thúc chuỗi của DAT,
+    # không được có trong dòng) rồi encode 1 lần, cắt lại theo \x00
+    text = '\x00'.join(lines)
+    text = text.replace('<cf>', '\r\n').replace('<lf>', '\n').replace('<cr>', '\r')
+    encoded = text.encode('utf-8').split(b'\x00')
+    if len(encoded) != len(lines):
+        print("File TXT chứa ký tự \\x00, không nhập được")
+        return
     with open(dat, 'rb') as f:
         files_count = int.from_bytes(f.read(4), 'little')
         if files_count != len(lines):
@@ -43,24 +48,22 @@ def import_text(dat_path, txt_path):
         base = int.from_bytes(f.read(4), 'little') + 4
         f.seek(0)
         header = bytearray(f.read(base))
-        offset = base
+    # chuỗi nối bằng \x00\x00, chuỗi cuối chỉ 1 \x00; offset mỗi entry = vị trí bắt đầu chuỗi - 4
+    newtext = b'\x00\x00'.join(encoded) + b'\x00'
+    offsets = list(accumulate((len(b) + 2 for b in encoded[:-1]), initial=base - 4))
+    table_end = 0x0C + files_count * 0x0C
+    if table_end <= len(header):
+        # ghi lại cả bảng entry 1 lần: giữ nguyên 8 byte sau offset của mỗi entry
+        rest = [r for (r,) in struct.iter_unpack('<4x8s', header[0x0C:table_end])]
+        header[0x0C:table_end] = struct.pack('<' + 'I8s' * files_count,
+                                             *(v for pair in zip(offsets, rest) for v in pair))
+    else:
+        # offset chuỗi đầu trỏ vào trong bảng entry -> header ngắn hơn bảng, ghi từng entry như cũ
         pos = 0x0C
-        newtext = b'\x00'
-        for i in range(files_count):
-            line = lines[i]
-            line = line.replace('<cf>', '\r\n').replace('<lf>', '\n').replace('<cr>', '\r')
-            bnew = line.encode('utf-8')
-            if i == files_count - 1:
-                bnew += b'\x00'
-            else:
-                bnew += b'\x00\x00'
-            newlen = len(bnew)
-            newtext += bnew
-            value = offset - 4
+        for value in offsets:
             header[pos:pos+4] = value.to_bytes(4, 'little')
-            offset += newlen
             pos += 0x0C
-    newfile = header + newtext[1:]
+    newfile = header + newtext
     new_dat = dat.parent / (dat.stem + '_new' + dat.suffix)
     with open(new_dat, 'wb') as out:
         out.write(newfile)